@@ -3588,6 +3588,9 @@ class SqliteDatabase(Database):
 
     def get_indexes(self, table, schema=None):
         schema = schema or 'main'
+        if self.server_version >= (3, 16, 0):
+            return self._get_indexes_joined(table, schema)
+
         query = ('SELECT name, sql FROM "%s".sqlite_master '
                  'WHERE tbl_name = ? AND type = ? ORDER BY name') % schema
         cursor = self.execute_sql(query, (table, 'index'))
@@ -3619,6 +3622,26 @@ class SqliteDatabase(Database):
                 table)
             for name in sorted(index_to_sql)]
 
+    def _get_indexes_joined(self, table, schema):
+        # Use the pragma table-valued functions to retrieve the indexes, along
+        # with whether they are unique and their columns, in a single query.
+        query = ('SELECT m.name, m.sql, il."unique", ii.name '
+                 'FROM "%s".sqlite_master AS m '
+                 'LEFT JOIN pragma_index_list(m.tbl_name, ?) AS il '
+                 'ON il.name = m.name '
+                 'LEFT JOIN pragma_index_info(m.name, ?) AS ii '
+                 'WHERE m.tbl_name = ? AND m.type = ? '
+                 'ORDER BY m.name, ii.seqno') % schema
+        cursor = self.execute_sql(query, (schema, schema, table, 'index'))
+
+        accum = []
+        for name, sql, is_unique, column in cursor.fetchall():
+            if not accum or accum[-1].name != name:
+                accum.append(IndexMetadata(name, sql, [], is_unique == 1,
+                                           table))
+            accum[-1].columns.append(column)
+        return accum
+
     def get_columns(self, table, schema=None):
         cursor = self.execute_sql('PRAGMA "%s".table_info("%s")' %
                                   (schema or 'main', table))
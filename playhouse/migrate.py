@@ -24,12 +24,11 @@ are generated by the migrator:
         migrator.add_column('some_table', 'column_name', CharField(default=''))
     )
 
-Migrations are not run inside a transaction, so if you wish the migration to
-run in a transaction you will need to wrap the call to `migrate` in a
-transaction block, e.g.:
+The operations passed to `migrate` are run inside a single transaction, so
+either all of them are applied or none are. To run the operations without
+wrapping them in a transaction, specify `atomic=False`:
 
-    with my_db.transaction():
-        migrate(...)
+    migrate(..., atomic=False)
 
 Supported Operations
 --------------------
@@ -116,6 +115,7 @@ Adding or dropping table constraints:
     migrate(migrator.add_unique('person', 'first_name', 'last_name'))
 """
 from collections import namedtuple
+import copy
 import functools
 import hashlib
 import re
@@ -135,10 +135,32 @@ try:
     from playhouse.cockroachdb import CockroachDatabase
 except ImportError:
     CockroachDatabase = None
+try:
+    from playhouse.sqliteq import SqliteQueueDatabase
+except ImportError:
+    SqliteQueueDatabase = None
+
+
+# SQL fragments are immutable, so share a single instance of each.
+_SQL_DROP_TABLE = SQL('DROP TABLE')
+_SQL_DROP_TABLE_IF_EXISTS = SQL('DROP TABLE IF EXISTS')
+_SQL_FROM = SQL('FROM')
+_SQL_INSERT_INTO = SQL('INSERT INTO')
+_SQL_NOT_NULL = SQL('NOT NULL')
+_SQL_NULL = SQL('NULL')
+_SQL_PRIMARY_KEY = SQL('PRIMARY KEY')
+_SQL_SELECT = SQL('SELECT')
+_SQL_UNIQUE = SQL('UNIQUE')
+
+_RESULT_QUERY = 1
+_RESULT_OPERATION = 2
+_RESULT_LIST = 3
 
 
 class Operation(object):
     """Encapsulate a single schema altering operation."""
+    _result_types = {}
+
     def __init__(self, migrator, method, *args, **kwargs):
         self.migrator = migrator
         self.method = method
@@ -146,16 +168,46 @@ class Operation(object):
         self.kwargs = kwargs
 
     def execute(self, node):
-        self.migrator.database.execute(node)
+        if isinstance(node, Context):
+            # The SQL has already been generated, so execute it directly
+            # rather than copying it into a new context.
+            self.migrator.database.execute_sql(*node.query())
+        else:
+            self.migrator.database.execute(node)
+
+    @classmethod
+    def _result_type(cls, item):
+        # Classify a result by its exact type, resolving the type using
+        # isinstance checks only the first time it is seen.
+        item_type = type(item)
+        try:
+            return cls._result_types[item_type]
+        except KeyError:
+            pass
+        if issubclass(item_type, (Node, Context)):
+            result_type = _RESULT_QUERY
+        elif issubclass(item_type, Operation):
+            result_type = _RESULT_OPERATION
+        elif issubclass(item_type, (list, tuple)):
+            result_type = _RESULT_LIST
+        else:
+            result_type = None
+        cls._result_types[item_type] = result_type
+        return result_type
 
     def _handle_result(self, result):
-        if isinstance(result, (Node, Context)):
-            self.execute(result)
-        elif isinstance(result, Operation):
-            result.run()
-        elif isinstance(result, (list, tuple)):
-            for item in result:
-                self._handle_result(item)
+        # Process nested lists of results using an explicit stack rather than
+        # recursion. Items are pushed in reverse so they execute in order.
+        stack = [result]
+        while stack:
+            item = stack.pop()
+            result_type = self._result_type(item)
+            if result_type == _RESULT_QUERY:
+                self.execute(item)
+            elif result_type == _RESULT_OPERATION:
+                item.run()
+            elif result_type == _RESULT_LIST:
+                stack.extend(reversed(item))
 
     def run(self):
         kwargs = self.kwargs.copy()
@@ -185,12 +237,18 @@ def make_index_name(table_name, columns):
 class SchemaMigrator(object):
     explicit_create_foreign_key = False
     explicit_delete_foreign_key = False
+    transactional_ddl = True
 
     def __init__(self, database):
         self.database = database
+        self._context_options = None
 
     def make_context(self):
-        return self.database.get_sql_context()
+        # The context options depend only on the database, so compute them
+        # once and re-use them for every statement the migrator generates.
+        if self._context_options is None:
+            self._context_options = self.database.get_context_options()
+        return self.database.context_class(**self._context_options)
 
     @classmethod
     def from_database(cls, database):
@@ -233,14 +291,14 @@ class SchemaMigrator(object):
     def alter_add_column(self, table, column_name, field):
         # Make field null at first.
         ctx = self.make_context()
-        field_null, field.null = field.null, True
         field.name = field.column_name = column_name
+        null_field = copy.copy(field)
+        null_field.null = True
         (self
          ._alter_table(ctx, table)
          .literal(' ADD COLUMN ')
-         .sql(field.ddl(ctx)))
+         .sql(null_field.ddl(ctx)))
 
-        field.null = field_null
         if isinstance(field, ForeignKeyField):
             self.add_inline_fk_sql(ctx, field)
         return ctx
@@ -258,7 +316,7 @@ class SchemaMigrator(object):
     def add_unique(self, table, *column_names):
         constraint_name = 'uniq_%s' % '_'.join(column_names)
         constraint = NodeList((
-            SQL('UNIQUE'),
+            _SQL_UNIQUE,
             EnclosedNodeList([Entity(column) for column in column_names])))
         return self.add_constraint(table, constraint_name, constraint)
 
@@ -317,6 +375,14 @@ class SchemaMigrator(object):
         if is_foreign_key and not field.rel_field:
             raise ValueError('Foreign keys must specify a `field`.')
 
+        # In the common case of a nullable, unindexed column, a single query
+        # is all that is needed.
+        if field.null and not (field.index or field.unique or
+                               (is_foreign_key and
+                                self.explicit_create_foreign_key)):
+            return self.alter_add_column(table, column_name, field,
+                                         with_context=True)
+
         operations = [self.alter_add_column(table, column_name, field)]
 
         # In the event the field is *not* nullable, update with the default
@@ -425,19 +491,26 @@ class SchemaMigrator(object):
 
 
 class PostgresqlMigrator(SchemaMigrator):
-    def _primary_key_columns(self, tbl):
+    def _primary_key_sequences(self, tbl):
+        # Returns a list of (column name, sequence exists) 2-tuples for the
+        # primary-key column(s) of the table, where the sequence is the one
+        # implicitly created for a serial column.
         query = """
-            SELECT pg_attribute.attname
+            SELECT pg_attribute.attname, EXISTS (
+                SELECT 1
+                FROM information_schema.sequences
+                WHERE LOWER(sequence_name) = LOWER(
+                    %s || '_' || pg_attribute.attname || '_seq'))
             FROM pg_index, pg_class, pg_attribute
             WHERE
-                pg_class.oid = '%s'::regclass AND
+                pg_class.oid = %s::regclass AND
                 indrelid = pg_class.oid AND
                 pg_attribute.attrelid = pg_class.oid AND
                 pg_attribute.attnum = any(pg_index.indkey) AND
                 indisprimary;
         """
-        cursor = self.database.execute_sql(query % tbl)
-        return [row[0] for row in cursor.fetchall()]
+        cursor = self.database.execute_sql(query, (tbl, tbl))
+        return [(row[0], row[1]) for row in cursor.fetchall()]
 
     @operation
     def set_search_path(self, schema_name):
@@ -447,23 +520,18 @@ class PostgresqlMigrator(SchemaMigrator):
 
     @operation
     def rename_table(self, old_name, new_name):
-        pk_names = self._primary_key_columns(old_name)
+        pk_sequences = self._primary_key_sequences(old_name)
         ParentClass = super(PostgresqlMigrator, self)
 
         operations = [
             ParentClass.rename_table(old_name, new_name, with_context=True)]
 
-        if len(pk_names) == 1:
-            # Check for existence of primary key sequence.
-            seq_name = '%s_%s_seq' % (old_name, pk_names[0])
-            query = """
-                SELECT 1
-                FROM information_schema.sequences
-                WHERE LOWER(sequence_name) = LOWER(%s)
-            """
-            cursor = self.database.execute_sql(query, (seq_name,))
-            if bool(cursor.fetchone()):
-                new_seq_name = '%s_%s_seq' % (new_name, pk_names[0])
+        if len(pk_sequences) == 1:
+            # Rename the primary key sequence, if one exists.
+            pk_name, has_sequence = pk_sequences[0]
+            if has_sequence:
+                seq_name = '%s_%s_seq' % (old_name, pk_name)
+                new_seq_name = '%s_%s_seq' % (new_name, pk_name)
                 operations.append(ParentClass.rename_table(
                     seq_name, new_seq_name))
 
@@ -472,6 +540,9 @@ class PostgresqlMigrator(SchemaMigrator):
 
 class CockroachDBMigrator(PostgresqlMigrator):
     explicit_create_foreign_key = True
+    # CockroachDB does not allow schema changes to follow writes within the
+    # same transaction, e.g. add_column() followed by apply_default().
+    transactional_ddl = False
 
     def add_inline_fk_sql(self, ctx, field):
         pass
@@ -508,13 +579,13 @@ class MySQLColumn(namedtuple('_Column', ('name', 'definition', 'null', 'pk',
             Entity(column_name),
             SQL(self.definition)]
         if self.is_unique:
-            parts.append(SQL('UNIQUE'))
+            parts.append(_SQL_UNIQUE)
         if is_null:
-            parts.append(SQL('NULL'))
+            parts.append(_SQL_NULL)
         else:
-            parts.append(SQL('NOT NULL'))
+            parts.append(_SQL_NOT_NULL)
         if self.is_pk:
-            parts.append(SQL('PRIMARY KEY'))
+            parts.append(_SQL_PRIMARY_KEY)
         if self.extra:
             parts.append(SQL(self.extra))
         return NodeList(parts)
@@ -523,6 +594,8 @@ class MySQLColumn(namedtuple('_Column', ('name', 'definition', 'null', 'pk',
 class MySQLMigrator(SchemaMigrator):
     explicit_create_foreign_key = True
     explicit_delete_foreign_key = True
+    # DDL statements cause an implicit commit in MySQL.
+    transactional_ddl = False
 
     def _alter_column(self, ctx, table, column):
         return (self
@@ -540,13 +613,18 @@ class MySQLMigrator(SchemaMigrator):
                 .sql(Entity(new_name)))
 
     def _get_column_definition(self, table, column_name):
-        cursor = self.database.execute_sql('DESCRIBE `%s`;' % table)
-        rows = cursor.fetchall()
-        for row in rows:
-            column = MySQLColumn(*row)
-            if column.name == column_name:
-                return column
-        return False
+        cursor = self.database.execute_sql(
+            ('SELECT column_name, column_type, is_nullable, column_key, '
+             'column_default, extra '
+             'FROM information_schema.columns WHERE '
+             'table_schema = DATABASE() AND '
+             'table_name = %s AND '
+             'column_name = %s;'),
+            (table, column_name))
+        row = cursor.fetchone()
+        if row is None:
+            return False
+        return MySQLColumn(*row)
 
     def get_foreign_key_constraint(self, table, column_name):
         cursor = self.database.execute_sql(
@@ -666,9 +744,18 @@ class SqliteMigrator(SchemaMigrator):
     full details http://sqlite.org/lang_altertable.html
     """
     column_re = re.compile('(.+?)\((.+)\)')
-    column_split_re = re.compile(r'(?:[^,(]|\([^)]*\))+')
     column_name_re = re.compile(r'''["`']?([\w]+)''')
+    whitespace_re = re.compile(r'\s+')
     fk_re = re.compile(r'FOREIGN KEY\s+\("?([\w]+)"?\)\s+', re.I)
+    constraint_terms = ('check ', 'check(', 'constraint ', 'foreign ',
+                        'primary ', 'unique ', 'unique(')
+    constraint_initials = frozenset('cCfFpPuU')
+
+    def __init__(self, database):
+        super(SqliteMigrator, self).__init__(database)
+        # SqliteQueueDatabase does not support transactions.
+        if SqliteQueueDatabase and isinstance(database, SqliteQueueDatabase):
+            self.transactional_ddl = False
 
     def _get_column_names(self, table):
         res = self.database.execute_sql('select * from "%s" limit 1' % table)
@@ -681,6 +768,34 @@ class SqliteMigrator(SchemaMigrator):
             ['table', table.lower()])
         return res.fetchone()
 
+    def _is_constraint(self, column_def):
+        return (column_def[:1] in self.constraint_initials and
+                column_def.lower().startswith(self.constraint_terms))
+
+    def _split_columns(self, raw_columns):
+        # Split the column list of a CREATE TABLE query on top-level commas,
+        # ignoring commas inside parentheses or quoted strings/identifiers.
+        accum = []
+        depth = start = 0
+        quote = None
+        for i, char in enumerate(raw_columns):
+            if quote is not None:
+                if char == quote:
+                    quote = None
+            elif char in '"\'`':
+                quote = char
+            elif char == '[':
+                quote = ']'
+            elif char == '(':
+                depth += 1
+            elif char == ')':
+                depth -= 1
+            elif char == ',' and depth == 0:
+                accum.append(raw_columns[start:i].strip())
+                start = i + 1
+        accum.append(raw_columns[start:].strip())
+        return accum
+
     @operation
     def _update_column(self, table, column_to_update, fn):
         columns = set(column.name.lower()
@@ -695,24 +810,19 @@ class SqliteMigrator(SchemaMigrator):
         # Get the indexes and SQL to re-create indexes.
         indexes = self.database.get_indexes(table)
 
-        # Find any foreign keys we may need to remove.
-        self.database.get_foreign_keys(table)
-
         # Make sure the create_table does not contain any newlines or tabs,
         # allowing the regex to work correctly.
-        create_table = re.sub(r'\s+', ' ', create_table)
+        create_table = self.whitespace_re.sub(' ', create_table)
 
         # Parse out the `CREATE TABLE` and column list portions of the query.
         raw_create, raw_columns = self.column_re.search(create_table).groups()
 
         # Clean up the individual column definitions.
-        split_columns = self.column_split_re.findall(raw_columns)
-        column_defs = [col.strip() for col in split_columns]
+        column_defs = self._split_columns(raw_columns)
 
         new_column_defs = []
         new_column_names = []
         original_column_names = []
-        constraint_terms = ('foreign ', 'primary ', 'constraint ')
 
         for column_def in column_defs:
             column_name, = self.column_name_re.match(column_def).groups()
@@ -729,7 +839,7 @@ class SqliteMigrator(SchemaMigrator):
                 new_column_defs.append(column_def)
 
                 # Avoid treating constraints as columns.
-                if not column_def.lower().startswith(constraint_terms):
+                if not self._is_constraint(column_def):
                     new_column_names.append(column_name)
                     original_column_names.append(column_name)
 
@@ -757,76 +867,81 @@ class SqliteMigrator(SchemaMigrator):
 
         # Update the name of the new CREATE TABLE query.
         temp_table = table + '__tmp__'
-        rgx = re.compile('("?)%s("?)' % table, re.I)
+        rgx = re.compile('("?)%s("?)' % re.escape(table), re.I)
         create = rgx.sub(
             '\\1%s\\2' % temp_table,
             raw_create)
 
         # Create the new table.
-        columns = ', '.join(cleaned_columns)
+        create_temp = NodeList((
+            SQL(create.strip()),
+            EnclosedNodeList([SQL(col) for col in cleaned_columns])))
         queries = [
-            NodeList([SQL('DROP TABLE IF EXISTS'), Entity(temp_table)]),
-            SQL('%s (%s)' % (create.strip(), columns))]
+            NodeList([_SQL_DROP_TABLE_IF_EXISTS, Entity(temp_table)]),
+            create_temp]
 
-        # Populate new table.
+        # Populate new table. Most columns keep their name, so the entities
+        # are shared between the INSERT and SELECT column lists.
+        entities = dict((col, Entity(col)) for col in new_column_names)
         populate_table = NodeList((
-            SQL('INSERT INTO'),
+            _SQL_INSERT_INTO,
             Entity(temp_table),
-            EnclosedNodeList([Entity(col) for col in new_column_names]),
-            SQL('SELECT'),
-            CommaNodeList([Entity(col) for col in original_column_names]),
-            SQL('FROM'),
+            EnclosedNodeList([entities[col] for col in new_column_names]),
+            _SQL_SELECT,
+            CommaNodeList([entities.get(col) or Entity(col)
+                           for col in original_column_names]),
+            _SQL_FROM,
             Entity(table)))
-        drop_original = NodeList([SQL('DROP TABLE'), Entity(table)])
+        drop_original = NodeList([_SQL_DROP_TABLE, Entity(table)])
 
         # Drop existing table and rename temp table.
         queries += [
             populate_table,
             drop_original,
-            self.rename_table(temp_table, table)]
+            self.rename_table(temp_table, table, with_context=True)]
 
         # Re-create user-defined indexes. User-defined indexes will have a
         # non-empty SQL attribute.
+        column_rgx = None
         for index in filter(lambda idx: idx.sql, indexes):
             if column_to_update not in index.columns:
                 queries.append(SQL(index.sql))
             elif new_column:
-                sql = self._fix_index(index.sql, column_to_update, new_column)
-                if sql is not None:
-                    queries.append(SQL(sql))
+                if column_rgx is None:
+                    column_rgx = self._make_column_rgx(column_to_update)
+                sql = self._fix_index(index.sql, column_rgx, new_column)
+                queries.append(SQL(sql))
 
         return queries
 
-    def _fix_index(self, sql, column_to_update, new_column):
-        # Split on the name of the column to update. If it splits into two
-        # pieces, then there's no ambiguity and we can simply replace the
-        # old with the new.
-        parts = sql.split(column_to_update)
-        if len(parts) == 2:
-            return sql.replace(column_to_update, new_column)
-
-        # Find the list of columns in the index expression.
-        lhs, rhs = sql.rsplit('(', 1)
-
-        # Apply the same "split in two" logic to the column list portion of
-        # the query.
-        if len(rhs.split(column_to_update)) == 2:
-            return '%s(%s' % (lhs, rhs.replace(column_to_update, new_column))
-
-        # Strip off the trailing parentheses and go through each column.
-        parts = rhs.rsplit(')', 1)[0].split(',')
-        columns = [part.strip('"`[]\' ') for part in parts]
-
-        # `columns` looks something like: ['status', 'timestamp" DESC']
-        # https://www.sqlite.org/lang_keywords.html
-        # Strip out any junk after the column name.
-        clean = []
-        for column in columns:
-            if re.match('%s(?:[\'"`\]]?\s|$)' % column_to_update, column):
-                column = new_column + column[len(column_to_update):]
-            clean.append(column)
-
-        return '%s(%s)' % (lhs, ', '.join('"%s"' % c for c in clean))
+    def _make_column_rgx(self, column):
+        # Match, in order of precedence:
+        # 1. the column as a complete quoted identifier,
+        # 2. any other string literal or quoted identifier, which is left
+        #    as-is,
+        # 3. the column as a bare identifier, not part of a longer one.
+        column = re.escape(column)
+        return re.compile(
+            r'''("%s"|`%s`|\[%s\])|'''
+            r'''('(?:[^']|'')*'|"(?:[^"]|"")*"|`(?:[^`]|``)*`|\[[^\]]*\])|'''
+            r'''((?<![\w"`\[\]])%s(?![\w"`\[\]]))''' %
+            (column, column, column, column))
+
+    def _fix_index(self, sql, column_rgx, new_column):
+        # Only rewrite the portion of the query following the first
+        # parenthesis, i.e. the indexed columns and any WHERE clause, so that
+        # the index and table names are left untouched.
+        lhs, rhs = sql.split('(', 1)
+
+        def _replace(match):
+            quoted, other, bare = match.groups()
+            if quoted is not None:
+                return quoted[0] + new_column + quoted[-1]
+            elif other is not None:
+                return other
+            return new_column
+
+        return '%s(%s' % (lhs, column_rgx.sub(_replace, rhs))
 
     @operation
     def drop_column(self, table, column_name, cascade=True):
@@ -877,5 +992,18 @@ class SqliteMigrator(SchemaMigrator):
 
 
 def migrate(*operations, **kwargs):
-    for operation in operations:
-        operation.run()
+    atomic = kwargs.pop('atomic', True)
+    if not operations:
+        return
+
+    migrator = operations[0].migrator
+    if not (atomic and migrator.transactional_ddl):
+        for operation in operations:
+            operation.run()
+        return
+
+    # Run all operations in a single transaction, so the migration is applied
+    # (and committed) as a unit.
+    with migrator.database.atomic():
+        for operation in operations:
+            operation.run()
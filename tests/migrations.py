@@ -4,6 +4,7 @@ from functools import partial
 
 from peewee import *
 from playhouse.migrate import *
+from playhouse.sqliteq import SqliteQueueDatabase
 from .base import BaseTestCase
 from .base import IS_CRDB
 from .base import IS_MYSQL
@@ -658,6 +659,21 @@ class TestSchemaMigration(ModelTestCase):
             migrate,
             self.migrator.rename_column('page', 'xx', 'yy'))
 
+    @skip_if(IS_MYSQL or IS_CRDB, 'no transactional ddl')
+    def test_migrate_atomic(self):
+        # An error in any of the operations rolls back the entire migration.
+        with self.assertRaises(ValueError):
+            migrate(
+                self.migrator.add_column('tag', 'alias', TextField(null=True)),
+                self.migrator.add_column('tag', 'bad', TextField()))
+        self.assertEqual(self.get_column_names('tag'), set(['id', 'tag']))
+
+        migrate(
+            self.migrator.add_column('tag', 'alias', TextField(null=True)),
+            atomic=False)
+        self.assertEqual(self.get_column_names('tag'),
+                         set(['id', 'tag', 'alias']))
+
     @requires_sqlite
     @requires_models(IndexModel)
     def test_table_case_insensitive(self):
@@ -731,12 +747,34 @@ class TestSchemaMigration(ModelTestCase):
             field))
         queries = [x.msg for x in self.history]
         self.assertEqual(queries, [
+            ('BEGIN', None),
             ('ALTER TABLE "category" ADD COLUMN "parent_id" '
              'INTEGER REFERENCES "category" ("id") ON DELETE SET NULL', []),
             ('CREATE INDEX "category_parent_id" ON "category" ("parent_id")',
              []),
         ])
 
+    def _get_indexes_queries(self, table, index_names):
+        if self.database.server_version >= (3, 16, 0):
+            return [('SELECT m.name, m.sql, il."unique", ii.name '
+                     'FROM "main".sqlite_master AS m '
+                     'LEFT JOIN pragma_index_list(m.tbl_name, ?) AS il '
+                     'ON il.name = m.name '
+                     'LEFT JOIN pragma_index_info(m.name, ?) AS ii '
+                     'WHERE m.tbl_name = ? AND m.type = ? '
+                     'ORDER BY m.name, ii.seqno',
+                     ('main', 'main', table, 'index'))]
+
+        queries = [
+            ('SELECT name, sql FROM "main".sqlite_master '
+             'WHERE tbl_name = ? AND type = ? ORDER BY name',
+             (table, 'index')),
+            ('PRAGMA "main".index_list("%s")' % table, None)]
+        for index_name in index_names:
+            queries.append(
+                ('PRAGMA "main".index_info("%s")' % index_name, None))
+        return queries
+
     @requires_sqlite
     @requires_models(IndexModel)
     def test_index_preservation(self):
@@ -748,6 +786,8 @@ class TestSchemaMigration(ModelTestCase):
 
         queries = [x.msg for x in self.history]
         self.assertEqual(queries, [
+            ('BEGIN', None),
+
             # Get all the columns.
             ('PRAGMA "main".table_info("index_model")', None),
 
@@ -757,16 +797,9 @@ class TestSchemaMigration(ModelTestCase):
              ['table', 'index_model']),
 
             # Get the indexes and indexed columns for the table.
-            ('SELECT name, sql FROM "main".sqlite_master '
-             'WHERE tbl_name = ? AND type = ? ORDER BY name',
-             ('index_model', 'index')),
-            ('PRAGMA "main".index_list("index_model")', None),
-            ('PRAGMA "main".index_info("index_model_data")', None),
-            ('PRAGMA "main".index_info("index_model_first_name_last_name")',
-             None),
-
-            # Get foreign keys.
-            ('PRAGMA "main".foreign_key_list("index_model")', None),
+        ] + self._get_indexes_queries('index_model', [
+            'index_model_data',
+            'index_model_first_name_last_name']) + [
 
             # Drop any temporary table, if it exists.
             ('DROP TABLE IF EXISTS "index_model__tmp__"', []),
@@ -808,21 +841,19 @@ class TestSchemaMigration(ModelTestCase):
 
         queries = [x.msg for x in self.history]
         self.assertEqual(queries, [
+            ('BEGIN', None),
+
             # Get all columns for table.
             ('PRAGMA "main".table_info("page")', None),
 
             # Get the SQL used to generate the table and indexes.
             ('select name, sql from sqlite_master '
              'where type=? and LOWER(name)=?', ['table', 'page']),
-            ('SELECT name, sql FROM "main".sqlite_master '
-             'WHERE tbl_name = ? AND type = ? ORDER BY name',
-             ('page', 'index')),
 
             # Get the indexes and indexed columns for the table.
-            ('PRAGMA "main".index_list("page")', None),
-            ('PRAGMA "main".index_info("page_name")', None),
-            ('PRAGMA "main".index_info("page_user_id")', None),
-            ('PRAGMA "main".foreign_key_list("page")', None),
+        ] + self._get_indexes_queries('page', [
+            'page_name',
+            'page_user_id']) + [
 
             # Clear out a temp table and create it w/o the user_id FK.
             ('DROP TABLE IF EXISTS "page__tmp__"', []),
@@ -911,3 +942,114 @@ class TestSqliteColumnNameRegression(ModelTestCase):
 
         data.update(foreign_data='fx')
         self.assertTrue(BNT.insert(data).execute())
+
+    def test_sqlite_table_name_regex_chars(self):
+        self.database.execute_sql('CREATE TABLE "t+x" ("id" INTEGER '
+                                  'NOT NULL PRIMARY KEY, "data" TEXT)')
+        migrator = SchemaMigrator.from_database(self.database)
+        migrate(migrator.rename_column('t+x', 'data', 'value'))
+
+        columns = self.database.get_columns('t+x')
+        self.assertEqual([column.name for column in columns],
+                         ['id', 'value'])
+
+    def test_sqlite_column_split(self):
+        self.database.execute_sql(
+            'CREATE TABLE "kv" ("id" INTEGER NOT NULL PRIMARY KEY, '
+            '"key" TEXT DEFAULT \'a,b\', '
+            '"value" REAL CHECK (abs(round("value", 1)) < 10), '
+            '"extra" TEXT)')
+        self.database.execute_sql('INSERT INTO "kv" ("value") VALUES (1.5)')
+        migrator = SchemaMigrator.from_database(self.database)
+        migrate(migrator.drop_column('kv', 'extra'))
+
+        columns = self.database.get_columns('kv')
+        self.assertEqual([column.name for column in columns],
+                         ['id', 'key', 'value'])
+        KV = Table('kv', ('id', 'key', 'value')).bind(self.database)
+        self.assertEqual(list(KV.select().tuples()), [(1, 'a,b', 1.5)])
+        self.assertRaises(IntegrityError, KV.insert(value=20).execute)
+
+    def test_sqlite_rename_column_index_sql(self):
+        self.database.execute_sql(
+            'CREATE TABLE "ev" ("id" INTEGER NOT NULL PRIMARY KEY, '
+            '"status" TEXT, "status_code" INTEGER)')
+        self.database.execute_sql(
+            'CREATE INDEX "ev_status" ON "ev" ("status" DESC, "status_code") '
+            'WHERE status != \'status\' AND status != \'a status b\'')
+        migrator = SchemaMigrator.from_database(self.database)
+        migrate(migrator.rename_column('ev', 'status', 'state'))
+
+        index, = self.database.get_indexes('ev')
+        self.assertEqual(index.sql, (
+            'CREATE INDEX "ev_status" ON "ev" ("state" DESC, "status_code") '
+            'WHERE state != \'status\' AND state != \'a status b\''))
+        self.assertEqual(index.columns, ['state', 'status_code'])
+
+        # Only the column itself is renamed, not text within other quoted
+        # identifiers.
+        column_rgx = migrator._make_column_rgx('status')
+        self.assertEqual(migrator._fix_index(
+            'CREATE INDEX "i" ON "t" ("status code", "status", `status`, '
+            '[status], "my status")', column_rgx, 'state'), (
+            'CREATE INDEX "i" ON "t" ("status code", "state", `state`, '
+            '[state], "my status")'))
+
+    def test_sqlite_table_constraints(self):
+        self.database.execute_sql(
+            'CREATE TABLE "pair" ("id" INTEGER NOT NULL PRIMARY KEY, '
+            '"a" INTEGER, "b" INTEGER, "c" TEXT, '
+            'UNIQUE ("a", "b"), CHECK ("a" < "b"))')
+        self.database.execute_sql('INSERT INTO "pair" ("a", "b", "c") '
+                                  'VALUES (1, 2, \'x\')')
+        migrator = SchemaMigrator.from_database(self.database)
+        migrate(migrator.drop_column('pair', 'c'))
+
+        columns = self.database.get_columns('pair')
+        self.assertEqual([column.name for column in columns],
+                         ['id', 'a', 'b'])
+        Pair = Table('pair', ('id', 'a', 'b')).bind(self.database)
+        self.assertEqual(list(Pair.select().tuples()), [(1, 1, 2)])
+        self.assertRaises(IntegrityError, Pair.insert(a=1, b=2).execute)
+        self.assertRaises(IntegrityError, Pair.insert(a=3, b=2).execute)
+
+
+class TestSqliteQueueMigration(BaseTestCase):
+    def setUp(self):
+        super(TestSqliteQueueMigration, self).setUp()
+        self.database = SqliteQueueDatabase('peewee_test_sqliteq.db')
+
+    def tearDown(self):
+        super(TestSqliteQueueMigration, self).tearDown()
+        self.database.stop()
+        if os.path.exists(self.database.database):
+            os.unlink(self.database.database)
+
+    def test_migrate_without_transaction(self):
+        # SqliteQueueDatabase does not support transactions, so migrations
+        # are run without one.
+        self.database.start()
+        curs = self.database.execute_sql('CREATE TABLE "kv" ("id" INTEGER '
+                                         'NOT NULL PRIMARY KEY, "key" TEXT)')
+        curs.fetchall()  # Wait for the writer to create the table.
+
+        migrator = SchemaMigrator.from_database(self.database)
+        self.assertFalse(migrator.transactional_ddl)
+        migrate(migrator.add_column('kv', 'value', TextField(null=True)))
+
+        columns = self.database.get_columns('kv')
+        self.assertEqual([column.name for column in columns],
+                         ['id', 'key', 'value'])
+
+
+class TestMySQLColumn(BaseTestCase):
+    def test_column_sql(self):
+        column = MySQLColumn('id', 'int(11)', 'NO', 'PRI', None,
+                             'auto_increment')
+        self.assertSQL(column.sql(), (
+            '"id" int(11) NOT NULL PRIMARY KEY auto_increment'), [])
+
+        column = MySQLColumn('name', 'varchar(255)', 'YES', 'UNI', None, '')
+        self.assertSQL(column.sql(), '"name" varchar(255) UNIQUE NULL', [])
+        self.assertSQL(column.sql(column_name='title', is_null=False), (
+            '"title" varchar(255) UNIQUE NOT NULL'), [])